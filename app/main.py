@@ -1,22 +1,67 @@
 from __future__ import annotations
 
+import hashlib
 import importlib
+import logging
+import queue
 import re
 import shutil
 import subprocess
 import threading
-import urllib.error
-import urllib.request
-from collections.abc import Callable, Iterator, Mapping
-from functools import lru_cache
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable, Iterator, Mapping
+from contextlib import asynccontextmanager, contextmanager, suppress
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Annotated, Any, Literal, ParamSpec, Protocol, Self, TypeVar, cast
-from urllib.parse import urlparse
+from typing import Annotated, Any, Literal, NamedTuple, ParamSpec, Protocol, Self, TypeVar, cast
+from urllib.parse import parse_qs, urlparse
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import HTMLResponse, StreamingResponse
+import anyio
+import httpx
+from anyio.abc import Process, TaskGroup
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+FFMPEG_PATH = shutil.which("ffmpeg")
+
+HTTP_TIMEOUT = httpx.Timeout(30.0)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=None,
+    max_keepalive_connections=32,
+    keepalive_expiry=60.0,
+)
+HTTP_CONNECT_RETRIES = 2
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide client so upstream media requests share pooled connections."""
+    transport = httpx.AsyncHTTPTransport(limits=HTTP_LIMITS, retries=HTTP_CONNECT_RETRIES)
+    return httpx.AsyncClient(transport=transport, follow_redirects=True, timeout=HTTP_TIMEOUT)
+
+
+@asynccontextmanager
+async def lifespan(fastapi_app: FastAPI) -> AsyncIterator[None]:
+    if FFMPEG_PATH is None:
+        logger.warning("ffmpeg was not found on PATH; mp3 downloads will fail")
+    client = get_http_client()
+    try:
+        async with anyio.create_task_group() as task_group:
+            # Owns per-request feeder tasks so response iterators never yield inside a task group.
+            fastapi_app.state.task_group = task_group
+            yield
+            task_group.cancel_scope.cancel()
+    finally:
+        fastapi_app.state.task_group = None
+        get_http_client.cache_clear()
+        await client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 P = ParamSpec("P")
 R = TypeVar("R")
@@ -27,27 +72,80 @@ fastapi_get = cast(
 
 TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
 INDEX_TEMPLATE = TEMPLATES_DIR / "index.html"
+INDEX_CACHE_CONTROL = "public, max-age=300"
+
+# The template ships with the app, so it is read once and served from memory; edits need a restart.
+INDEX_BYTES: bytes | None
+INDEX_ETAG: str | None
+try:
+    INDEX_BYTES = INDEX_TEMPLATE.read_bytes()
+except FileNotFoundError:
+    INDEX_BYTES = INDEX_ETAG = None
+else:
+    INDEX_ETAG = f'"{hashlib.blake2b(INDEX_BYTES, digest_size=16).hexdigest()}"'
 
 
-@lru_cache(maxsize=1)
 def load_index_template() -> str:
-    try:
-        return INDEX_TEMPLATE.read_text(encoding="utf-8")
-    except FileNotFoundError as exc:
-        raise HTTPException(status_code=500, detail="Index template is unavailable") from exc
+    if INDEX_BYTES is None:
+        raise HTTPException(status_code=500, detail="Index template is unavailable")
+    return INDEX_BYTES.decode("utf-8")
 
 
 FormatLiteral = Literal["video", "mp3"]
 UrlParam = Annotated[str, Query(..., description="Direct YouTube video URL")]
 FormatParam = Annotated[FormatLiteral, Query(pattern="^(video|mp3)$")]
 
-INVALID_FILENAME_CHARS = set('<>:"/\\|?*')
-STREAM_CHUNK_SIZE = 65536
+INVALID_FILENAME_CHARS = frozenset('<>:"/\\|?*')
+FILENAME_TRANSLATION = str.maketrans(
+    dict.fromkeys([*INVALID_FILENAME_CHARS, *map(chr, range(32))], "_")
+)
+WHITESPACE_RE = re.compile(r"\s+")
+MAX_FILENAME_LENGTH = 150
+HTTP_CHUNK_SIZE = 256 * 1024
+FFMPEG_PIPE_CHUNK_SIZE = 64 * 1024
+# ffmpeg writes in small packets; batch them so each ASGI send carries a useful payload.
+FFMPEG_FLUSH_SIZE = 256 * 1024
+FFMPEG_STDERR_LIMIT = 64 * 1024
 StreamInfo = dict[str, Any]
+RANGE_RESPONSE_HEADERS = ("Content-Range", "Content-Length")
+# Multi-range requests would come back as multipart/byteranges, which is relayed as plain video.
+SINGLE_BYTE_RANGE_RE = re.compile(r"bytes=(\d+-\d*|-\d+)")
+
+# Audio-only sources carry a single stream, so a short probe is enough to start encoding.
+FFMPEG_MP3_ARGS = (
+    "-hide_banner",
+    "-loglevel",
+    "error",
+    "-fflags",
+    "+nobuffer",
+    "-probesize",
+    "32768",
+    "-analyzeduration",
+    "0",
+    "-i",
+    "pipe:0",
+    "-map",
+    "0:a:0",
+    "-f",
+    "mp3",
+    "-codec:a",
+    "libmp3lame",
+    "pipe:1",
+)
 
 VIDEO_FORMAT_SELECTOR = "bestvideo[ext=mp4][height<=1080]+bestaudio[ext=m4a]/best[ext=mp4]/best"
 VIDEO_FALLBACK_FORMAT = "best[ext=mp4]/best"
 AUDIO_FORMAT_SELECTOR = "bestaudio/best"
+VIDEO_MEDIA_TYPES = {"mp4": "video/mp4", "webm": "video/webm", "mkv": "video/x-matroska"}
+
+YDL_POOL_SIZE = 4
+INFO_CACHE_MAXSIZE = 512
+INFO_CACHE_TTL = 300.0
+# Fields read from cached extractions; the rest (captions, thumbnails, heatmaps) is dropped.
+CACHED_INFO_KEYS = ("title", "url", "ext", "http_headers")
+CACHED_FORMAT_KEYS = ("url", "ext", "http_headers", "vcodec", "acodec")
+# CDN answers to a signed URL that has been revoked or has expired early.
+STALE_MEDIA_STATUSES = frozenset({403, 410})
 
 YDL_BASE_OPTIONS: dict[str, Any] = {
     "quiet": True,
@@ -59,6 +157,40 @@ YDL_BASE_OPTIONS: dict[str, Any] = {
 }
 
 
+class PreparedStream(NamedTuple):
+    iterator: AsyncIterator[bytes]
+    media_type: str
+    extension: str
+    title: str | None
+    status_code: int = 200
+    headers: dict[str, str] | None = None
+    close: Callable[[], Awaitable[None]] | None = None
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """Run the stream's close hook however the response ends, even before the body starts."""
+
+    def __init__(
+        self,
+        content: AsyncIterator[bytes],
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str | None = None,
+        *,
+        close: Callable[[], Awaitable[None]] | None = None,
+    ) -> None:
+        super().__init__(content, status_code=status_code, headers=headers, media_type=media_type)
+        self.close = close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.close is not None:
+                with anyio.CancelScope(shield=True):
+                    await self.close()
+
+
 class YoutubeDLProtocol(Protocol):
     def __enter__(self: Self) -> Self: ...
 
@@ -66,6 +198,8 @@ class YoutubeDLProtocol(Protocol):
 
     def extract_info(self: Self, url: str, download: bool = ...) -> StreamInfo: ...
 
+    def close(self: Self) -> None: ...
+
 
 class YtDlpModule(Protocol):
     DownloadError: type[Exception]
@@ -76,12 +210,10 @@ class YtDlpModule(Protocol):
 yt_dlp = cast(YtDlpModule, importlib.import_module("yt_dlp"))
 
 
-@lru_cache(maxsize=1)
 def resolve_ffmpeg() -> str:
-    path = shutil.which("ffmpeg")
-    if path is None:
+    if FFMPEG_PATH is None:
         raise HTTPException(status_code=500, detail="ffmpeg is not available")
-    return path
+    return FFMPEG_PATH
 
 
 def create_ydl(format_selector: str | None = None) -> YoutubeDLProtocol:
@@ -91,58 +223,180 @@ def create_ydl(format_selector: str | None = None) -> YoutubeDLProtocol:
     return yt_dlp.YoutubeDL(options)
 
 
+_YDL_POOL: defaultdict[str | None, queue.SimpleQueue[YoutubeDLProtocol]] = defaultdict(
+    queue.SimpleQueue
+)
+
+
+@contextmanager
+def _checkout_ydl(format_selector: str | None) -> Iterator[YoutubeDLProtocol]:
+    """Lend a warmed YoutubeDL instance exclusively to the caller, returning it afterwards."""
+    pool = _YDL_POOL[format_selector]
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = create_ydl(format_selector)
+    try:
+        yield ydl
+    finally:
+        if pool.qsize() < YDL_POOL_SIZE:
+            pool.put(ydl)
+        else:
+            ydl.close()
+
+
+InfoCacheKey = tuple[str, str | None]
+_INFO_CACHE: OrderedDict[InfoCacheKey, tuple[float, StreamInfo]] = OrderedDict()
+_INFO_CACHE_LOCK = threading.Lock()
+
+
+def _media_urls(info: StreamInfo) -> Iterator[str]:
+    url = info.get("url")
+    if isinstance(url, str):
+        yield url
+    for key in ("requested_downloads", "requested_formats", "formats"):
+        candidates = info.get(key)
+        if isinstance(candidates, list):
+            for candidate in candidates:
+                if isinstance(candidate, dict) and isinstance(candidate.get("url"), str):
+                    yield candidate["url"]
+
+
+def _is_progressive(candidate: object) -> bool:
+    return (
+        isinstance(candidate, dict)
+        and isinstance(candidate.get("url"), str)
+        and candidate.get("vcodec") != "none"
+        and candidate.get("acodec") != "none"
+    )
+
+
+def _trim_format(candidate: object) -> object:
+    if not isinstance(candidate, dict):
+        return candidate
+    return {key: candidate[key] for key in CACHED_FORMAT_KEYS if key in candidate}
+
+
+def _trim_info(info: StreamInfo) -> StreamInfo:
+    """Keep only what stream selection reads; full results carry every format and caption URL."""
+    trimmed = {key: info[key] for key in CACHED_INFO_KEYS if key in info}
+    for key in ("requested_downloads", "requested_formats"):
+        candidates = info.get(key)
+        if isinstance(candidates, list):
+            trimmed[key] = [_trim_format(candidate) for candidate in candidates]
+    formats = info.get("formats")
+    if isinstance(formats, list):
+        # Only muxed formats can serve as the progressive fallback.
+        trimmed["formats"] = [_trim_format(item) for item in formats if _is_progressive(item)]
+    return trimmed
+
+
+def _signed_urls_expired(info: StreamInfo, now: float) -> bool:
+    for url in _media_urls(info):
+        for value in parse_qs(urlparse(url).query).get("expire", []):
+            if value.isdigit() and int(value) <= now:
+                return True
+    return False
+
+
+def _cached_extract(target_url: str, format_selector: str | None) -> StreamInfo:
+    """Memoize yt-dlp metadata per URL and selector until the TTL or signed URLs expire."""
+    key = (target_url, format_selector)
+    with _INFO_CACHE_LOCK:
+        entry = _INFO_CACHE.get(key)
+        if entry is not None:
+            deadline, info = entry
+            if deadline > time.monotonic() and not _signed_urls_expired(info, time.time()):
+                _INFO_CACHE.move_to_end(key)
+                return info
+            del _INFO_CACHE[key]
+
+    with _checkout_ydl(format_selector) as ydl:
+        info = _trim_info(ydl.extract_info(target_url, download=False))
+
+    with _INFO_CACHE_LOCK:
+        _INFO_CACHE[key] = (time.monotonic() + INFO_CACHE_TTL, info)
+        _INFO_CACHE.move_to_end(key)
+        while len(_INFO_CACHE) > INFO_CACHE_MAXSIZE:
+            _INFO_CACHE.popitem(last=False)
+    return info
+
+
+def _invalidate_media_url(media_url: str) -> None:
+    """Drop cached extractions pointing at a signed URL the CDN has started rejecting."""
+    with _INFO_CACHE_LOCK:
+        stale = [key for key, (_, info) in _INFO_CACHE.items() if media_url in _media_urls(info)]
+        for key in stale:
+            del _INFO_CACHE[key]
+
+
+def _info_title(info: StreamInfo) -> str | None:
+    title = info.get("title")
+    return title if isinstance(title, str) and title else None
+
+
 def fetch_video_title(target_url: str) -> str:
     try:
-        with create_ydl(None) as ydl:
-            info = ydl.extract_info(target_url, download=False)
+        title = _info_title(_cached_extract(target_url, None))
     except yt_dlp.DownloadError as exc:
         detail = str(exc).strip() or "Unable to retrieve video title"
         raise HTTPException(status_code=400, detail=detail) from exc
     except Exception as exc:  # pragma: no cover - defensive against unexpected failures
         raise HTTPException(status_code=500, detail="Failed to retrieve video metadata") from exc
 
-    title = cast(str | None, info.get("title"))
-    if not title:
+    if title is None:
         raise HTTPException(status_code=500, detail="Video title is unavailable")
     return title
 
 
 def sanitize_filename(title: str, extension: str) -> str:
-    cleaned = []
-    for char in title:
-        code_point = ord(char)
-        if code_point < 32 or char in INVALID_FILENAME_CHARS:
-            cleaned.append("_")
-            continue
-        cleaned.append(char)
-
-    sanitized = "".join(cleaned)
-    sanitized = re.sub(r"\s+", " ", sanitized).strip()
-    sanitized = sanitized.strip("._")
-    sanitized = sanitized.replace(" ", "_")
-
-    if not sanitized:
-        sanitized = "download"
-
-    max_length = 150
-    sanitized = sanitized[:max_length]
-
+    if title.isascii() and title.isprintable() and INVALID_FILENAME_CHARS.isdisjoint(title):
+        # Printable ASCII has no control characters and only plain spaces as whitespace.
+        sanitized = " ".join(title.split())
+    else:
+        sanitized = WHITESPACE_RE.sub(" ", title.translate(FILENAME_TRANSLATION)).strip()
+    sanitized = sanitized.strip("._").replace(" ", "_")
+    sanitized = sanitized[:MAX_FILENAME_LENGTH] or "download"
     return f"{sanitized}.{extension}"
 
 
 @fastapi_get("/", response_class=HTMLResponse)
-async def index() -> str:
-    return load_index_template()
+async def index(request: Request) -> Response:
+    if INDEX_BYTES is None or INDEX_ETAG is None:
+        raise HTTPException(status_code=500, detail="Index template is unavailable")
+
+    headers = {"ETag": INDEX_ETAG, "Cache-Control": INDEX_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == INDEX_ETAG:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(INDEX_BYTES, headers=headers)
 
 
 def _select_single_stream(info: StreamInfo) -> StreamInfo | None:
+    # A single selected format is merged into the top-level info, so its URL is the common case.
+    if isinstance(info.get("url"), str):
+        return info
     raw_candidates = info.get("requested_downloads") or info.get("requested_formats")
-    if isinstance(raw_candidates, list) and raw_candidates:
-        first = raw_candidates[0]
-        if len(raw_candidates) == 1 and isinstance(first, dict):
-            return cast(StreamInfo, first)
+    if (
+        isinstance(raw_candidates, list)
+        and len(raw_candidates) == 1
+        and isinstance(raw_candidates[0], dict)
+    ):
+        return cast(StreamInfo, raw_candidates[0])
+    return None
+
+
+def _best_progressive_format(info: StreamInfo, preferred_ext: str = "mp4") -> StreamInfo | None:
+    """Pick the best muxed format from an existing extraction, mirroring best[ext=mp4]/best."""
+    formats = info.get("formats")
+    if not isinstance(formats, list):
         return None
-    return info if isinstance(info.get("url"), str) else None
+    progressive = [candidate for candidate in formats if _is_progressive(candidate)]
+    # yt-dlp orders formats from worst to best.
+    preferred = [candidate for candidate in progressive if candidate.get("ext") == preferred_ext]
+    for candidates in (preferred, progressive):
+        if candidates:
+            return cast(StreamInfo, candidates[-1])
+    return None
 
 
 def _normalize_headers(headers: Mapping[str, Any] | None) -> dict[str, str]:
@@ -151,111 +405,171 @@ def _normalize_headers(headers: Mapping[str, Any] | None) -> dict[str, str]:
     return {str(key): str(value) for key, value in headers.items()}
 
 
+def _pick_headers(info: StreamInfo, stream: StreamInfo) -> dict[str, str]:
+    for source in (stream, info):
+        headers = source.get("http_headers")
+        if isinstance(headers, Mapping):
+            return _normalize_headers(cast(Mapping[str, Any], headers))
+    return {}
+
+
 def _ensure_http_scheme(url: str) -> None:
-    parsed = urlparse(url)
-    if parsed.scheme not in {"http", "https"}:
+    if not url.startswith(("http://", "https://")):
         raise HTTPException(status_code=400, detail="Unsupported media URL scheme")
 
 
-def _iter_http_chunks(download_url: str, headers: Mapping[str, str]) -> Iterator[bytes]:
-    _ensure_http_scheme(download_url)
-    request = urllib.request.Request(download_url, headers=dict(headers))  # noqa: S310 - scheme validated
+async def _open_upstream(download_url: str, headers: Mapping[str, str]) -> httpx.Response:
+    """Send the upstream request eagerly so HTTP errors surface before streaming starts."""
+    client = get_http_client()
+    request = client.build_request("GET", download_url, headers=dict(headers))
+    # Bytes are relayed raw (and piped into ffmpeg), so the CDN must not compress them.
+    request.headers["Accept-Encoding"] = "identity"
     try:
-        response = urllib.request.urlopen(request)  # noqa: S310 - scheme validated
-    except urllib.error.HTTPError as exc:  # pragma: no cover - network dependent
-        detail = exc.reason or "Media request failed"
-        raise HTTPException(status_code=exc.code, detail=detail) from exc
-    except urllib.error.URLError as exc:
+        response = await client.send(request, stream=True)
+    except httpx.HTTPError as exc:
         raise HTTPException(status_code=500, detail="Unable to retrieve media stream") from exc
 
-    def iterator() -> Iterator[bytes]:
-        with response:
-            yield from iter(lambda: response.read(STREAM_CHUNK_SIZE), b"")
+    if response.is_error:
+        await response.aclose()
+        if response.status_code in STALE_MEDIA_STATUSES:
+            # Retries would otherwise keep getting the same rejected URL until the TTL ends.
+            _invalidate_media_url(download_url)
+        detail = response.reason_phrase or "Media request failed"
+        raise HTTPException(status_code=response.status_code, detail=detail)
+    return response
+
 
-    return iterator()
+async def _iter_upstream_body(response: httpx.Response) -> AsyncGenerator[bytes, None]:
+    try:
+        async for chunk in response.aiter_raw(HTTP_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await response.aclose()
 
 
-def _transcode_to_mp3(download_url: str, headers: Mapping[str, str]) -> Iterator[bytes]:
-    _ensure_http_scheme(download_url)
-    request = urllib.request.Request(download_url, headers=dict(headers))  # noqa: S310 - scheme validated
+def _background_tasks() -> TaskGroup:
+    task_group = getattr(app.state, "task_group", None)
+    if task_group is None:
+        raise HTTPException(status_code=503, detail="Server is not ready")
+    return cast(TaskGroup, task_group)
+
+
+async def _run_detached(task: Callable[[], Awaitable[None]]) -> None:
+    """Run a per-request task in the app-wide group without letting its failure escape."""
     try:
-        source = urllib.request.urlopen(request)  # noqa: S310 - scheme validated
-    except urllib.error.HTTPError as exc:  # pragma: no cover - network dependent
-        detail = exc.reason or "Audio request failed"
-        raise HTTPException(status_code=exc.code, detail=detail) from exc
-    except urllib.error.URLError as exc:
-        raise HTTPException(status_code=500, detail="Unable to retrieve audio stream") from exc
+        await task()
+    except Exception:
+        logger.exception("Background stream task failed")
+
 
+def _kill_process(process: Process) -> None:
+    if process.returncode is None:
+        with suppress(ProcessLookupError):  # exited and reaped since the check
+            process.kill()
+
+
+async def _transcode_to_mp3(
+    download_url: str,
+    headers: Mapping[str, str],
+) -> tuple[AsyncIterator[bytes], Callable[[], Awaitable[None]]]:
+    """Return the mp3 body and a close hook that releases it even if it is never iterated."""
     ffmpeg = resolve_ffmpeg()
+    background_tasks = _background_tasks()
+    upstream = await _open_upstream(download_url, headers)
+    source = _iter_upstream_body(upstream)
 
     try:
-        process = subprocess.Popen(  # noqa: S603 - command assembled from controlled template
-            [
-                ffmpeg,
-                "-loglevel",
-                "error",
-                "-i",
-                "pipe:0",
-                "-vn",
-                "-f",
-                "mp3",
-                "-codec:a",
-                "libmp3lame",
-                "pipe:1",
-            ],
+        process = await anyio.open_process(
+            [ffmpeg, *FFMPEG_MP3_ARGS],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            bufsize=0,
         )
-    except FileNotFoundError as exc:  # pragma: no cover - handled by resolve_ffmpeg
-        source.close()
+    except OSError as exc:  # pragma: no cover - handled by resolve_ffmpeg
+        await upstream.aclose()
         raise HTTPException(status_code=500, detail="ffmpeg is not available") from exc
 
     stdin = process.stdin
     stdout = process.stdout
     stderr = process.stderr
 
-    if stdin is None or stdout is None or stderr is None:
-        process.kill()
-        source.close()
+    if stdin is None or stdout is None or stderr is None:  # pragma: no cover - pipes requested
+        _kill_process(process)
+        await upstream.aclose()
         raise HTTPException(status_code=500, detail="Unable to start audio encoder")
 
-    def pump() -> None:
+    async def pump() -> None:
         try:
-            for chunk in iter(lambda: source.read(STREAM_CHUNK_SIZE), b""):
-                if not chunk:
-                    break
-                try:
-                    stdin.write(chunk)
-                except BrokenPipeError:  # pragma: no cover - depends on ffmpeg behaviour
-                    break
+            async for chunk in source:
+                await stdin.send(chunk)
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            return  # ffmpeg exited or the response was closed
+        except Exception:
+            # Upstream failed mid-stream; stopping ffmpeg surfaces it as an encoder error.
+            logger.exception("Upstream media read failed while feeding ffmpeg")
+            _kill_process(process)
         finally:
-            try:
-                stdin.close()
-            finally:
-                source.close()
+            with anyio.CancelScope(shield=True):
+                await stdin.aclose()
+                await source.aclose()
 
-    feeder = threading.Thread(target=pump, daemon=True)
-    feeder.start()
+    error_output = bytearray()
+    stderr_drained = anyio.Event()
 
-    def iterator() -> Iterator[bytes]:
+    async def drain_stderr() -> None:
+        # Keep the pipe empty so a chatty encoder never blocks; only the tail is reported.
         try:
-            yield from iter(lambda: stdout.read(STREAM_CHUNK_SIZE), b"")
-            feeder.join()
-            returncode = process.wait()
+            async for chunk in stderr:
+                error_output.extend(chunk)
+                del error_output[:-FFMPEG_STDERR_LIMIT]
+        except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+            pass  # the response was closed and the process torn down
+        finally:
+            stderr_drained.set()
+
+    started = False
+
+    async def iterator() -> AsyncGenerator[bytes, None]:
+        nonlocal started
+        started = True
+        background_tasks.start_soon(_run_detached, pump)
+        background_tasks.start_soon(_run_detached, drain_stderr)
+        buffer = bytearray()
+        try:
+            while True:
+                try:
+                    buffer += await stdout.receive(FFMPEG_PIPE_CHUNK_SIZE)
+                except anyio.EndOfStream:
+                    break
+                if len(buffer) >= FFMPEG_FLUSH_SIZE:
+                    yield bytes(buffer)
+                    buffer.clear()
+            if buffer:
+                yield bytes(buffer)
+            returncode = await process.wait()
             if returncode:
-                error_text = stderr.read().decode("utf-8", errors="ignore").strip()
+                await stderr_drained.wait()
+                error_text = error_output.decode("utf-8", errors="ignore").strip()
                 detail = error_text or f"ffmpeg exited with code {returncode}"
                 raise RuntimeError(detail)
         finally:
-            stdout.close()
-            stderr.close()
-            if process.poll() is None:  # pragma: no cover - defensive shutdown
-                process.kill()
-                process.wait()
+            _kill_process(process)
+            with anyio.CancelScope(shield=True):
+                await process.aclose()
 
-    return iterator()
+    body = iterator()
+
+    async def close() -> None:
+        if started:
+            await body.aclose()
+            return
+        # The body was dropped before its first chunk, so neither the feeder nor its cleanup ran.
+        _kill_process(process)
+        with anyio.CancelScope(shield=True):
+            await process.aclose()
+            await upstream.aclose()
+
+    return body, close
 
 
 def _extract_stream_info(
@@ -264,9 +578,9 @@ def _extract_stream_info(
     *,
     fallback_selector: str | None = None,
 ) -> tuple[StreamInfo, StreamInfo]:
+    # Blocking: yt-dlp does network I/O, so async callers run this in a worker thread.
     try:
-        with create_ydl(format_selector) as ydl:
-            info = ydl.extract_info(target_url, download=False)
+        info = _cached_extract(target_url, format_selector)
     except yt_dlp.DownloadError as exc:
         detail = str(exc).strip() or "Unable to resolve media stream"
         raise HTTPException(status_code=400, detail=detail) from exc
@@ -275,9 +589,12 @@ def _extract_stream_info(
 
     stream = _select_single_stream(info)
     if stream is None and fallback_selector is not None:
-        with create_ydl(fallback_selector) as ydl:
-            info = ydl.extract_info(target_url, download=False)
-        stream = _select_single_stream(info)
+        # Separate video and audio URLs cannot be proxied as one file; reuse the muxed formats
+        # already listed before paying for a second extraction with the fallback selector.
+        stream = _best_progressive_format(info)
+        if stream is None:
+            info = _cached_extract(target_url, fallback_selector)
+            stream = _select_single_stream(info)
 
     if stream is None:
         raise HTTPException(status_code=500, detail="Unable to identify a direct media stream")
@@ -285,65 +602,93 @@ def _extract_stream_info(
     return info, stream
 
 
-def prepare_video_stream(target_url: str) -> tuple[Iterator[bytes], str, str]:
-    info, stream = _extract_stream_info(
-        target_url,
-        VIDEO_FORMAT_SELECTOR,
-        fallback_selector=VIDEO_FALLBACK_FORMAT,
+async def prepare_video_stream(
+    target_url: str,
+    *,
+    range_header: str | None = None,
+) -> PreparedStream:
+    info, stream = await anyio.to_thread.run_sync(
+        partial(
+            _extract_stream_info,
+            target_url,
+            VIDEO_FORMAT_SELECTOR,
+            fallback_selector=VIDEO_FALLBACK_FORMAT,
+        )
     )
-    if isinstance(stream.get("http_headers"), Mapping):
-        headers_mapping = cast(Mapping[str, Any], stream["http_headers"])
-    elif isinstance(info.get("http_headers"), Mapping):
-        headers_mapping = cast(Mapping[str, Any], info["http_headers"])
-    else:
-        headers_mapping = None
-    headers = _normalize_headers(headers_mapping)
+    headers = _pick_headers(info, stream)
     download_url = cast(str | None, stream.get("url"))
     if not download_url:
         raise HTTPException(status_code=500, detail="Stream URL is unavailable")
-    iterator = _iter_http_chunks(download_url, headers)
+    _ensure_http_scheme(download_url)
+    if range_header and SINGLE_BYTE_RANGE_RE.fullmatch(range_header.strip()):
+        headers["Range"] = range_header.strip()
+    upstream = await _open_upstream(download_url, headers)
     extension = cast(str | None, stream.get("ext") or info.get("ext")) or "mp4"
-    media_type = "video/mp4" if extension == "mp4" else f"video/{extension}"
-    return iterator, media_type, extension
+    media_type = VIDEO_MEDIA_TYPES.get(extension) or f"video/{extension}"
+    response_headers = {"Accept-Ranges": "bytes"}
+    if upstream.status_code == 206:
+        for name in RANGE_RESPONSE_HEADERS:
+            if name in upstream.headers:
+                response_headers[name] = upstream.headers[name]
+    return PreparedStream(
+        _iter_upstream_body(upstream),
+        media_type,
+        extension,
+        _info_title(info),
+        status_code=upstream.status_code,
+        headers=response_headers,
+        close=upstream.aclose,
+    )
 
 
-def prepare_mp3_stream(target_url: str) -> tuple[Iterator[bytes], str, str]:
-    info, stream = _extract_stream_info(target_url, AUDIO_FORMAT_SELECTOR)
-    if isinstance(stream.get("http_headers"), Mapping):
-        headers_mapping = cast(Mapping[str, Any], stream["http_headers"])
-    elif isinstance(info.get("http_headers"), Mapping):
-        headers_mapping = cast(Mapping[str, Any], info["http_headers"])
-    else:
-        headers_mapping = None
-    headers = _normalize_headers(headers_mapping)
+async def prepare_mp3_stream(target_url: str) -> PreparedStream:
+    info, stream = await anyio.to_thread.run_sync(
+        _extract_stream_info, target_url, AUDIO_FORMAT_SELECTOR
+    )
+    headers = _pick_headers(info, stream)
     download_url = cast(str | None, stream.get("url"))
     if not download_url:
         raise HTTPException(status_code=500, detail="Stream URL is unavailable")
-    iterator = _transcode_to_mp3(download_url, headers)
-    return iterator, "audio/mpeg", "mp3"
+    _ensure_http_scheme(download_url)
+    iterator, close = await _transcode_to_mp3(download_url, headers)
+    return PreparedStream(iterator, "audio/mpeg", "mp3", _info_title(info), close=close)
 
 
-def build_stream(target_url: str, output_format: FormatLiteral) -> tuple[Iterator[bytes], str, str]:
+async def build_stream(
+    target_url: str,
+    output_format: FormatLiteral,
+    *,
+    range_header: str | None = None,
+) -> PreparedStream:
     if output_format == "video":
-        return prepare_video_stream(target_url)
+        return await prepare_video_stream(target_url, range_header=range_header)
     if output_format == "mp3":
-        return prepare_mp3_stream(target_url)
+        return await prepare_mp3_stream(target_url)
     raise HTTPException(status_code=400, detail="Unsupported format")
 
 
 @fastapi_get("/stream")
 async def stream(
+    request: Request,
     url: UrlParam,
     format: FormatParam = "video",
 ) -> StreamingResponse:
-    iterator, media_type, extension = build_stream(url, format)
-    try:
-        title = fetch_video_title(url)
-        filename = sanitize_filename(title, extension)
-    except HTTPException:
-        filename = f"download.{extension}"
-
-    response = StreamingResponse(iterator, media_type=media_type)
-    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-    response.headers["Cache-Control"] = "no-store"
-    return response
+    # Seeks in a <video> element arrive as Range requests; mp3 output is always a full transcode.
+    range_header = request.headers.get("range") if format == "video" else None
+    prepared = await build_stream(url, format, range_header=range_header)
+    extension = prepared.extension
+    title = prepared.title
+    filename = sanitize_filename(title, extension) if title else f"download.{extension}"
+
+    headers = {
+        **(prepared.headers or {}),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store",
+    }
+    return ClosingStreamingResponse(
+        prepared.iterator,
+        status_code=prepared.status_code,
+        headers=headers,
+        media_type=prepared.media_type,
+        close=prepared.close,
+    )
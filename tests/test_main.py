@@ -1,11 +1,18 @@
 from __future__ import annotations
 
 import importlib
-from collections.abc import Callable, Iterator
+import sys
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from pathlib import Path
 from typing import Any, TypeVar, cast
 
+import anyio
+import httpx
 import pytest
-from fastapi import HTTPException
+from anyio.abc import TaskGroup
+from fastapi import HTTPException, Request
+from starlette.requests import ClientDisconnect
 
 import app.main as main
 
@@ -20,6 +27,15 @@ def parametrize(*args: Any, **kwargs: Any) -> Callable[[TestFunc], TestFunc]:
     return cast(Callable[[TestFunc], TestFunc], pytest.mark.parametrize(*args, **kwargs))
 
 
+@pytest.fixture(autouse=True)
+def reset_extractor_state() -> Iterator[None]:
+    main._INFO_CACHE.clear()
+    main._YDL_POOL.clear()
+    yield
+    main._INFO_CACHE.clear()
+    main._YDL_POOL.clear()
+
+
 class StubYDL:
     def __init__(
         self,
@@ -37,6 +53,9 @@ class StubYDL:
     def __exit__(self, *_args: Any) -> None:
         return None
 
+    def close(self) -> None:
+        return None
+
     def extract_info(self, url: str, download: bool) -> dict[str, Any]:
         self.calls.append((url, download))
         if self._error is not None:
@@ -50,6 +69,48 @@ def test_load_index_template_returns_html() -> None:
     assert "Dreamy Downloader" in template
 
 
+def make_request(headers: dict[str, str] | None = None) -> Request:
+    raw_headers = [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "headers": raw_headers})
+
+
+async def test_index_serves_template_from_memory() -> None:
+    response = await main.index(make_request())
+
+    assert response.body == main.INDEX_TEMPLATE.read_bytes()
+    assert response.media_type == "text/html"
+    assert response.headers["content-length"] == str(len(response.body))
+    assert response.headers["cache-control"] == main.INDEX_CACHE_CONTROL
+    assert response.headers["etag"] == main.INDEX_ETAG
+
+
+async def test_index_honors_if_none_match() -> None:
+    etag = (await main.index(make_request())).headers["etag"]
+
+    response = await main.index(make_request({"If-None-Match": etag}))
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+async def test_index_reports_missing_template(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(main, "INDEX_BYTES", None)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await main.index(make_request())
+
+    assert excinfo.value.status_code == 500
+
+
+def test_resolve_ffmpeg_reports_missing_binary(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(main, "FFMPEG_PATH", None)
+
+    with pytest.raises(HTTPException) as excinfo:
+        main.resolve_ffmpeg()
+
+    assert excinfo.value.status_code == 500
+
+
 def test_fetch_video_title_success(monkeypatch: pytest.MonkeyPatch) -> None:
     stub = StubYDL({"title": "Example Title"})
     monkeypatch.setattr(main, "create_ydl", lambda _fmt: stub)
@@ -82,20 +143,92 @@ def test_fetch_video_title_missing_title(monkeypatch: pytest.MonkeyPatch) -> Non
     assert excinfo.value.status_code == 500
 
 
+def test_cached_extract_reuses_info(monkeypatch: pytest.MonkeyPatch) -> None:
+    stub = StubYDL({"title": "Cached", "url": "https://media.example/a.mp4"})
+    monkeypatch.setattr(main, "create_ydl", lambda _fmt: stub)
+
+    first = main._cached_extract("https://example.com", "best")
+    second = main._cached_extract("https://example.com", "best")
+
+    assert first is second
+    assert stub.calls == [("https://example.com", False)]
+
+
+def test_cached_extract_reuses_pooled_extractors(monkeypatch: pytest.MonkeyPatch) -> None:
+    created: list[StubYDL] = []
+
+    def fake_create(_fmt: str | None) -> StubYDL:
+        created.append(StubYDL({"url": "https://media.example/a.mp4"}))
+        return created[-1]
+
+    monkeypatch.setattr(main, "create_ydl", fake_create)
+
+    main._cached_extract("https://example.com/one", "best")
+    main._cached_extract("https://example.com/two", "best")
+
+    assert len(created) == 1
+    assert [call[0] for call in created[0].calls] == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_cached_extract_refreshes_expired_signed_urls(monkeypatch: pytest.MonkeyPatch) -> None:
+    stub = StubYDL({"url": "https://media.example/a.mp4?expire=1"})
+    monkeypatch.setattr(main, "create_ydl", lambda _fmt: stub)
+
+    main._cached_extract("https://example.com", "best")
+    main._cached_extract("https://example.com", "best")
+
+    assert len(stub.calls) == 2
+
+
+def test_cached_extract_keeps_only_selection_fields(monkeypatch: pytest.MonkeyPatch) -> None:
+    muxed = {"url": "https://media.example/m.mp4", "ext": "mp4", "vcodec": "avc1", "acodec": "mp4a"}
+    stub = StubYDL(
+        {
+            "title": "Clip",
+            "automatic_captions": {"en": [{"url": "https://captions.example/en"}]},
+            "thumbnails": [{"url": "https://img.example/t.jpg"}],
+            "formats": [
+                {"url": "https://media.example/v.mp4", "vcodec": "avc1", "acodec": "none"},
+                {**muxed, "format_note": "360p", "fragments": [{"path": "a"}]},
+            ],
+        }
+    )
+    monkeypatch.setattr(main, "create_ydl", lambda _fmt: stub)
+
+    info = main._cached_extract("https://example.com", "best")
+
+    assert info == {"title": "Clip", "formats": [muxed]}
+    assert main._best_progressive_format(info) == muxed
+
+
 @parametrize(
     "title,extension,expected",
     [
         ("Video:Title*?", "mp3", "Video_Title.mp3"),
         ("   spaced   name   ", "mp4", "spaced_name.mp4"),
         ("<>\\/:|?*", "mp3", "download.mp3"),
+        (".hidden. clip _", "mp4", "hidden._clip_.mp4"),
+        ("Tab\tSeparated\nTitle", "mp3", "Tab_Separated_Title.mp3"),
     ],
 )
 def test_sanitize_filename(title: str, extension: str, expected: str) -> None:
     assert main.sanitize_filename(title, extension) == expected
 
 
-def test_prepare_video_stream_uses_http_iterator(monkeypatch: pytest.MonkeyPatch) -> None:
-    info = {"http_headers": {"X-Test": "info"}}
+async def collect(iterator: AsyncIterator[bytes]) -> list[bytes]:
+    return [chunk async for chunk in iterator]
+
+
+async def aiter_bytes(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_prepare_video_stream_uses_http_iterator(monkeypatch: pytest.MonkeyPatch) -> None:
+    info = {"title": "Clip", "http_headers": {"X-Test": "info"}}
     stream = {
         "url": "https://media.example/video.mp4",
         "ext": "mp4",
@@ -111,28 +244,97 @@ def test_prepare_video_stream_uses_http_iterator(monkeypatch: pytest.MonkeyPatch
         assert target_url == "https://example.com/video"
         assert selector == main.VIDEO_FORMAT_SELECTOR
         assert fallback_selector == main.VIDEO_FALLBACK_FORMAT
+        assert threading.current_thread() is not threading.main_thread()
         return info, stream
 
-    def fake_iter(url: str, headers: dict[str, str]) -> Iterator[bytes]:
+    async def fake_open(url: str, headers: dict[str, str]) -> httpx.Response:
         assert url == stream["url"]
         assert headers == stream["http_headers"]
+        return httpx.Response(200, stream=httpx.ByteStream(b"chunk"))
 
-        def generator() -> Iterator[bytes]:
-            yield b"chunk"
+    monkeypatch.setattr(main, "_extract_stream_info", fake_extract)
+    monkeypatch.setattr(main, "_open_upstream", fake_open)
 
-        return generator()
+    prepared = await main.prepare_video_stream("https://example.com/video")
 
-    monkeypatch.setattr(main, "_extract_stream_info", fake_extract)
-    monkeypatch.setattr(main, "_iter_http_chunks", fake_iter)
+    assert await collect(prepared.iterator) == [b"chunk"]
+    assert prepared.media_type == "video/mp4"
+    assert prepared.extension == "mp4"
+    assert prepared.title == "Clip"
+    assert prepared.status_code == 200
+    assert prepared.headers == {"Accept-Ranges": "bytes"}
+
+
+async def test_prepare_video_stream_relays_partial_content(monkeypatch: pytest.MonkeyPatch) -> None:
+    stream = {"url": "https://media.example/video.mp4", "ext": "mp4"}
+    monkeypatch.setattr(main, "_extract_stream_info", lambda *_args, **_kwargs: ({}, stream))
+
+    async def fake_open(_url: str, headers: dict[str, str]) -> httpx.Response:
+        assert headers == {"Range": "bytes=0-4"}
+        return httpx.Response(
+            206,
+            headers={"Content-Range": "bytes 0-4/10", "Content-Length": "5"},
+            stream=httpx.ByteStream(b"video"),
+        )
+
+    monkeypatch.setattr(main, "_open_upstream", fake_open)
+
+    prepared = await main.prepare_video_stream(
+        "https://example.com/video",
+        range_header="bytes=0-4",
+    )
+
+    assert await collect(prepared.iterator) == [b"video"]
+    assert prepared.status_code == 206
+    assert prepared.headers == {
+        "Accept-Ranges": "bytes",
+        "Content-Range": "bytes 0-4/10",
+        "Content-Length": "5",
+    }
+
+
+@parametrize("range_header", ["bytes=0-4,10-14", "bytes=abc", "items=0-4"])
+async def test_prepare_video_stream_drops_unsupported_ranges(
+    monkeypatch: pytest.MonkeyPatch,
+    range_header: str,
+) -> None:
+    stream = {"url": "https://media.example/video.mp4", "ext": "mp4"}
+    monkeypatch.setattr(main, "_extract_stream_info", lambda *_args, **_kwargs: ({}, stream))
+
+    async def fake_open(_url: str, headers: dict[str, str]) -> httpx.Response:
+        assert "Range" not in headers
+        return httpx.Response(200, stream=httpx.ByteStream(b"video"))
 
-    iterator, media_type, extension = main.prepare_video_stream("https://example.com/video")
+    monkeypatch.setattr(main, "_open_upstream", fake_open)
 
-    assert list(iterator) == [b"chunk"]
-    assert media_type == "video/mp4"
-    assert extension == "mp4"
+    prepared = await main.prepare_video_stream(
+        "https://example.com/video",
+        range_header=range_header,
+    )
+
+    assert prepared.status_code == 200
+    assert await collect(prepared.iterator) == [b"video"]
+
+
+def test_pick_headers_prefers_stream_headers() -> None:
+    info = {"http_headers": {"X-Test": "info"}}
+
+    assert main._pick_headers(info, {"http_headers": {"X-Test": 1}}) == {"X-Test": "1"}
+    assert main._pick_headers(info, {}) == {"X-Test": "info"}
+    assert main._pick_headers({}, {}) == {}
+
+
+async def test_prepare_video_stream_rejects_non_http_url(monkeypatch: pytest.MonkeyPatch) -> None:
+    stream = {"url": "file:///etc/passwd", "ext": "mp4"}
+    monkeypatch.setattr(main, "_extract_stream_info", lambda *_args, **_kwargs: ({}, stream))
+
+    with pytest.raises(HTTPException) as excinfo:
+        await main.prepare_video_stream("https://example.com/video")
+
+    assert excinfo.value.status_code == 400
 
 
-def test_prepare_mp3_stream_uses_transcoder(monkeypatch: pytest.MonkeyPatch) -> None:
+async def test_prepare_mp3_stream_uses_transcoder(monkeypatch: pytest.MonkeyPatch) -> None:
     info = {"http_headers": {"X-Test": "info"}}
     stream = {
         "url": "https://media.example/audio.webm",
@@ -145,22 +347,34 @@ def test_prepare_mp3_stream_uses_transcoder(monkeypatch: pytest.MonkeyPatch) ->
         lambda target_url, selector, **_: (info, stream),
     )
 
-    def fake_transcode(url: str, headers: dict[str, str]) -> Iterator[bytes]:
+    async def close() -> None:
+        pass
+
+    async def fake_transcode(
+        url: str, headers: dict[str, str]
+    ) -> tuple[AsyncIterator[bytes], Callable[[], Any]]:
         assert url == stream["url"]
         assert headers == stream["http_headers"]
+        return aiter_bytes(b"audio"), close
+
+    monkeypatch.setattr(main, "_transcode_to_mp3", fake_transcode)
 
-        def generator() -> Iterator[bytes]:
-            yield b"audio"
+    prepared = await main.prepare_mp3_stream("https://example.com/audio")
 
-        return generator()
+    assert await collect(prepared.iterator) == [b"audio"]
+    assert prepared.media_type == "audio/mpeg"
+    assert prepared.extension == "mp3"
+    assert prepared.title is None
+    assert prepared.close is close
 
-    monkeypatch.setattr(main, "_transcode_to_mp3", fake_transcode)
 
-    iterator, media_type, extension = main.prepare_mp3_stream("https://example.com/audio")
+def test_select_single_stream_prefers_top_level_url() -> None:
+    info = {"url": "https://stream/top", "requested_formats": [{"url": "https://stream/top"}]}
+    single = {"requested_formats": [{"url": "https://stream/only"}]}
 
-    assert list(iterator) == [b"audio"]
-    assert media_type == "audio/mpeg"
-    assert extension == "mp3"
+    assert main._select_single_stream(info) is info
+    assert main._select_single_stream(single) == {"url": "https://stream/only"}
+    assert main._select_single_stream({}) is None
 
 
 def test_extract_stream_info_triggers_fallback(monkeypatch: pytest.MonkeyPatch) -> None:
@@ -193,6 +407,36 @@ def test_extract_stream_info_triggers_fallback(monkeypatch: pytest.MonkeyPatch)
     assert calls == [main.VIDEO_FORMAT_SELECTOR, main.VIDEO_FALLBACK_FORMAT]
 
 
+def test_extract_stream_info_reuses_listed_progressive_format(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    calls: list[str | None] = []
+    info = {
+        "requested_formats": [{"url": "https://stream/video"}, {"url": "https://stream/audio"}],
+        "formats": [
+            {"url": "https://stream/audio", "ext": "m4a", "vcodec": "none", "acodec": "mp4a"},
+            {"url": "https://stream/360", "ext": "mp4", "vcodec": "avc1", "acodec": "mp4a"},
+            {"url": "https://stream/webm", "ext": "webm", "vcodec": "vp9", "acodec": "opus"},
+            {"url": "https://stream/video", "ext": "mp4", "vcodec": "avc1", "acodec": "none"},
+        ],
+    }
+
+    def fake_create(format_selector: str | None) -> StubYDL:
+        calls.append(format_selector)
+        return StubYDL(info)
+
+    monkeypatch.setattr(main, "create_ydl", fake_create)
+
+    _, stream = main._extract_stream_info(
+        "https://example.com",
+        main.VIDEO_FORMAT_SELECTOR,
+        fallback_selector=main.VIDEO_FALLBACK_FORMAT,
+    )
+
+    assert stream["url"] == "https://stream/360"
+    assert calls == [main.VIDEO_FORMAT_SELECTOR]
+
+
 def test_extract_stream_info_raises_when_unavailable(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr(main, "create_ydl", lambda _fmt: StubYDL({}))
 
@@ -202,26 +446,257 @@ def test_extract_stream_info_raises_when_unavailable(monkeypatch: pytest.MonkeyP
     assert excinfo.value.status_code == 500
 
 
-def test_build_stream_invalid_format() -> None:
+async def test_iter_upstream_body_streams_body(monkeypatch: pytest.MonkeyPatch) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["User-Agent"] == "abc"
+        return httpx.Response(200, stream=httpx.ByteStream(b"media-bytes"))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+
+    upstream = await main._open_upstream("https://media.example/v.mp4", {"User-Agent": "abc"})
+    iterator = main._iter_upstream_body(upstream)
+
+    assert b"".join(await collect(iterator)) == b"media-bytes"
+
+
+async def test_open_upstream_requests_identity_encoding(monkeypatch: pytest.MonkeyPatch) -> None:
+    seen: list[list[str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.headers.get_list("Accept-Encoding"))
+        return httpx.Response(200, stream=httpx.ByteStream(b"media-bytes"))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+
+    upstream = await main._open_upstream("https://media.example/v.mp4", {"accept-encoding": "gzip"})
+    await upstream.aclose()
+
+    assert seen == [["identity"]]
+
+
+async def test_open_upstream_forgets_rejected_signed_url(monkeypatch: pytest.MonkeyPatch) -> None:
+    stub = StubYDL({"url": "https://media.example/v.mp4?sig=old"})
+    monkeypatch.setattr(main, "create_ydl", lambda _fmt: stub)
+    main._cached_extract("https://example.com", "best")
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda _request: httpx.Response(403)))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+
+    with pytest.raises(HTTPException):
+        await main._open_upstream("https://media.example/v.mp4?sig=old", {})
+    main._cached_extract("https://example.com", "best")
+
+    assert len(stub.calls) == 2
+
+
+async def test_open_upstream_raises_on_upstream_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda _request: httpx.Response(403)))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+
     with pytest.raises(HTTPException) as excinfo:
-        main.build_stream("https://example.com", cast(main.FormatLiteral, "gif"))
+        await main._open_upstream("https://media.example/v.mp4", {})
+
+    assert excinfo.value.status_code == 403
+
+
+def use_media_payload(monkeypatch: pytest.MonkeyPatch, payload: bytes) -> None:
+    def handler(_request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=httpx.ByteStream(payload))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+
+
+def use_fake_encoder(monkeypatch: pytest.MonkeyPatch, path: Path, body: str) -> None:
+    path.write_text(f"#!{sys.executable}\nimport sys\n{body}\n", encoding="utf-8")
+    path.chmod(0o755)
+    monkeypatch.setattr(main, "resolve_ffmpeg", lambda: str(path))
+
+
+@pytest.fixture
+async def background_tasks(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[TaskGroup]:
+    async with anyio.create_task_group() as task_group:
+        monkeypatch.setattr(main.app.state, "task_group", task_group, raising=False)
+        yield task_group
+
+
+async def test_transcode_to_mp3_pipes_source_through_encoder(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    payload = b"frame" * 100_000
+    use_media_payload(monkeypatch, payload)
+    use_fake_encoder(
+        monkeypatch,
+        tmp_path / "ffmpeg",
+        "sys.stdout.buffer.write(sys.stdin.buffer.read())",
+    )
+
+    iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    assert b"".join(await collect(iterator)) == payload
+
+
+async def test_transcode_to_mp3_coalesces_small_encoder_writes(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    use_media_payload(monkeypatch, b"audio")
+    use_fake_encoder(
+        monkeypatch,
+        tmp_path / "ffmpeg",
+        "sys.stdin.buffer.read()\nfor _ in range(3):\n    sys.stdout.buffer.write(b'da')\n"
+        "    sys.stdout.buffer.flush()",
+    )
+
+    iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    assert await collect(iterator) == [b"dadada"]
+
+
+async def test_transcode_to_mp3_drains_chatty_encoder_stderr(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    use_media_payload(monkeypatch, b"audio")
+    use_fake_encoder(
+        monkeypatch,
+        tmp_path / "ffmpeg",
+        "sys.stdin.buffer.read()\nsys.stderr.write('warning\\n' * 50_000)\n"
+        "sys.stdout.buffer.write(b'mp3')",
+    )
+
+    with anyio.fail_after(10):
+        iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+        assert await collect(iterator) == [b"mp3"]
+
+
+class ResetAfterRelease(httpx.AsyncByteStream):
+    def __init__(self, release: anyio.Event) -> None:
+        self.release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        await self.release.wait()
+        raise httpx.ReadError("connection reset")
+        yield b""  # pragma: no cover - makes this an async generator
+
+
+async def test_transcode_to_mp3_survives_upstream_error_after_encoder_exit(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    release = anyio.Event()
+
+    def handler(_request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=ResetAfterRelease(release))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+    use_fake_encoder(monkeypatch, tmp_path / "ffmpeg", "sys.exit(0)")
+
+    iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    assert await collect(iterator) == []
+    # The encoder has been reaped; the feeder's failure must stay out of the shared group.
+    release.set()
+
+
+async def test_transcode_to_mp3_logs_upstream_failure(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    release = anyio.Event()
+    release.set()
+
+    def handler(_request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=ResetAfterRelease(release))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+    use_fake_encoder(monkeypatch, tmp_path / "ffmpeg", "sys.stdin.buffer.read()")
+
+    iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    with pytest.raises(RuntimeError):
+        await collect(iterator)
+
+    record = next(r for r in caplog.records if "feeding ffmpeg" in r.message)
+    assert record.exc_info is not None
+    assert isinstance(record.exc_info[1], httpx.ReadError)
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        yield b"audio"
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+async def test_transcode_to_mp3_close_releases_unstarted_body(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    upstream = TrackedStream()
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda _request: httpx.Response(200, stream=upstream))
+    )
+    monkeypatch.setattr(main, "get_http_client", lambda: client)
+    use_fake_encoder(monkeypatch, tmp_path / "ffmpeg", "sys.stdin.buffer.read()")
+
+    _iterator, close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    with anyio.fail_after(10):
+        await close()
+
+    assert upstream.closed
+
+
+async def test_transcode_to_mp3_reports_encoder_failure(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    background_tasks: TaskGroup,
+) -> None:
+    use_media_payload(monkeypatch, b"audio")
+    use_fake_encoder(
+        monkeypatch,
+        tmp_path / "ffmpeg",
+        "sys.stdin.buffer.read()\nsys.exit('bad input')",
+    )
+
+    iterator, _close = await main._transcode_to_mp3("https://media.example/a.webm", {})
+    with pytest.raises(RuntimeError, match="bad input"):
+        await collect(iterator)
+
+
+async def test_build_stream_invalid_format() -> None:
+    with pytest.raises(HTTPException) as excinfo:
+        await main.build_stream("https://example.com", cast(main.FormatLiteral, "gif"))
 
     assert excinfo.value.status_code == 400
 
 
 async def test_stream_endpoint_success(monkeypatch: pytest.MonkeyPatch) -> None:
-    def fake_build(
+    async def fake_build(
         target_url: str,
         output_format: main.FormatLiteral,
-    ) -> tuple[Iterator[bytes], str, str]:
+        *,
+        range_header: str | None = None,
+    ) -> main.PreparedStream:
         assert target_url == "https://example.com"
         assert output_format == "video"
-        return iter([b"payload"]), "video/mp4", "mp4"
+        assert range_header is None
+        return main.PreparedStream(aiter_bytes(b"payload"), "video/mp4", "mp4", "Great Clip")
 
     monkeypatch.setattr(main, "build_stream", fake_build)
-    monkeypatch.setattr(main, "fetch_video_title", lambda url: "Great Clip")
 
-    response = await main.stream(url="https://example.com", format="video")
+    response = await main.stream(make_request(), url="https://example.com", format="video")
 
     chunks: list[bytes] = [cast(bytes, chunk) async for chunk in response.body_iterator]
     assert b"".join(chunks) == b"payload"
@@ -231,16 +706,70 @@ async def test_stream_endpoint_success(monkeypatch: pytest.MonkeyPatch) -> None:
 
 
 async def test_stream_endpoint_fallback_filename(monkeypatch: pytest.MonkeyPatch) -> None:
-    monkeypatch.setattr(main, "build_stream", lambda *_: (iter([b"payload"]), "audio/mpeg", "mp3"))
+    async def fake_build(*_args: Any, **_kwargs: Any) -> main.PreparedStream:
+        return main.PreparedStream(aiter_bytes(b"payload"), "audio/mpeg", "mp3", None)
 
-    def fake_fetch(_url: str) -> str:
-        raise HTTPException(status_code=400, detail="boom")
-
-    monkeypatch.setattr(main, "fetch_video_title", fake_fetch)
+    monkeypatch.setattr(main, "build_stream", fake_build)
 
-    response = await main.stream(url="https://example.com", format="mp3")
+    response = await main.stream(make_request(), url="https://example.com", format="mp3")
 
     chunks: list[bytes] = [cast(bytes, chunk) async for chunk in response.body_iterator]
     assert b"".join(chunks) == b"payload"
     disposition = response.headers["content-disposition"]
     assert 'filename="download.mp3"' in disposition
+
+
+async def test_closing_response_runs_close_when_client_left_before_start() -> None:
+    closed: list[bool] = []
+    started: list[bool] = []
+
+    async def body() -> AsyncIterator[bytes]:
+        started.append(True)
+        yield b"payload"
+
+    async def close() -> None:
+        closed.append(True)
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.disconnect"}
+
+    async def send(_message: Any) -> None:
+        raise OSError("client went away")
+
+    response = main.ClosingStreamingResponse(body(), close=close)
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+
+    with pytest.raises(ClientDisconnect):
+        await response(scope, receive, send)
+
+    assert started == []
+    assert closed == [True]
+
+
+async def test_stream_endpoint_forwards_range(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def fake_build(
+        _target_url: str,
+        _output_format: main.FormatLiteral,
+        *,
+        range_header: str | None = None,
+    ) -> main.PreparedStream:
+        assert range_header == "bytes=5-"
+        return main.PreparedStream(
+            aiter_bytes(b"tail"),
+            "video/mp4",
+            "mp4",
+            "Clip",
+            status_code=206,
+            headers={"Content-Range": "bytes 5-8/9"},
+        )
+
+    monkeypatch.setattr(main, "build_stream", fake_build)
+
+    response = await main.stream(
+        make_request({"Range": "bytes=5-"}),
+        url="https://example.com",
+        format="video",
+    )
+
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 5-8/9"